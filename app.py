@@ -1,10 +1,10 @@
 # app.py
-import base64  # 顶部导入base64模块
 import streamlit as st
 from core_excel import process_excel_core
+import collections
 import datetime
-import os
-import tempfile
+import io
+import time
 
 # -------------------------- 页面基础配置（极致移动端适配） --------------------------
 st.set_page_config(
@@ -26,7 +26,7 @@ st.markdown("""
     h1 { font-size: 20px !important; text-align: center; margin-bottom: 20px !important; }
     h2 { font-size: 16px !important; margin-top: 15px !important; margin-bottom: 10px !important; }
     /* 按钮：占满整行、放大触控区域、圆角，适配手机点击 */
-    div.stButton > button {
+    div.stButton > button, div.stDownloadButton > button {
         width: 100% !important;
         padding: 12px 0 !important;
         border-radius: 8px !important;
@@ -60,22 +60,53 @@ st.markdown("""
 
 # -------------------------- 初始化Streamlit会话状态（保存日志/结果，避免刷新丢失） --------------------------
 if "log_list" not in st.session_state:
-    st.session_state.log_list = []  # 保存日志列表
+    st.session_state.log_list = collections.deque(maxlen=50)  # 保存日志（定长队列，只保留最新50条）
 if "process_success" not in st.session_state:
     st.session_state.process_success = False  # 处理是否成功
-if "save_path" not in st.session_state:
-    st.session_state.save_path = ""  # 结果文件路径（本地测试用）
+if "result_bytes" not in st.session_state:
+    st.session_state.result_bytes = None  # 结果文件字节流（直接用于下载）
 
-# -------------------------- 日志回调函数（适配Streamlit，实时更新日志区域） --------------------------
-def streamlit_log_callback(msg):
-    """自定义日志回调，将日志存入会话状态，实现实时更新"""
-    # 拼接时间戳，和原GUI/核心模块日志格式一致
+# -------------------------- 日志回调函数（适配Streamlit，更新日志区域） --------------------------
+def render_log_area():
+    """将会话状态中的日志渲染到日志区域"""
+    log_content = "\n".join(st.session_state.log_list)
+    log_placeholder.markdown(f'<div class="log-container">{log_content}</div>', unsafe_allow_html=True)
+
+
+def append_log(msg):
+    """仅将日志存入会话状态（拼接时间戳，和原GUI/核心模块日志格式一致），不刷新页面"""
     timestamp = datetime.datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    log_msg = f"{timestamp} {msg}"
-    st.session_state.log_list.append(log_msg)
-    # 实时更新日志区域（只保留最新50条，避免内存溢出）
-    if len(st.session_state.log_list) > 50:
-        st.session_state.log_list = st.session_state.log_list[-50:]
+    # 定长队列自动淘汰最旧的日志，避免内存溢出
+    st.session_state.log_list.append(f"{timestamp} {msg}")
+
+
+def streamlit_log_callback(msg):
+    """自定义日志回调，将日志存入会话状态并立即刷新日志区域（每次点击仅调用数次；核心日志由append_log批量回放）"""
+    append_log(msg)
+    render_log_area()
+
+# -------------------------- 核心处理缓存（相同文件重复处理时直接复用结果） --------------------------
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cached_process(template_bytes, data_bytes):
+    """
+    以上传文件的字节内容为缓存键调用核心处理函数，重复上传相同文件（如仅修改结果文件名）时直接返回缓存结果
+    核心日志先收集到列表中随结果一起返回（缓存函数内不能操作会话状态/页面元素），由调用方每次回放
+    :param template_bytes: 模板文件字节内容
+    :param data_bytes: 数据文件字节内容
+    :return: 处理结果（布尔值）、错误信息（str，成功为None）、结果文件字节流（失败为None）、
+             核心日志列表、实际处理完成时间（time.time()，用于判断是否命中缓存）
+    """
+    core_logs = []
+    # 上传文件内容直接以内存文件对象传入，结果也写入内存缓冲区，全程无需临时文件落盘
+    result_buffer = io.BytesIO()
+    success, error_msg = process_excel_core(
+        template_file=io.BytesIO(template_bytes),
+        data_file=io.BytesIO(data_bytes),
+        save_path=result_buffer,
+        log_callback=core_logs.append
+    )
+    result_bytes = result_buffer.getvalue() if success else None
+    return success, error_msg, result_bytes, core_logs, time.time()
 
 # -------------------------- 页面主体布局（移动端友好，从上到下流式布局） --------------------------
 st.title("📊 舟山Excel数据处理工具")
@@ -118,17 +149,14 @@ if not result_filename.endswith(".xlsx"):
 
 st.divider()
 
-# 4. 日志输出区域（实时更新，移动端适配）
-st.subheader("📜 处理日志（实时更新）", divider="gray")
+# 4. 日志输出区域（处理步骤开始/结束时更新，移动端适配）
+st.subheader("📜 处理日志", divider="gray")
 log_placeholder = st.empty()
-# 渲染日志区域
-with log_placeholder.container():
-    log_content = "\n".join(st.session_state.log_list)
-    st.markdown(f'<div class="log-container">{log_content}</div>', unsafe_allow_html=True)
-
 # 初始化日志（首次加载时）
 if len(st.session_state.log_list) == 0:
-    streamlit_log_callback("🔍 程序已就绪，请上传模板和数据文件后点击【开始处理】")
+    append_log("🔍 程序已就绪，请上传模板和数据文件后点击【开始处理】")
+# 渲染日志区域
+render_log_area()
 
 st.divider()
 
@@ -136,69 +164,57 @@ st.divider()
 st.subheader("🚀 开始处理", divider="gray")
 if st.button("开始处理数据", type="primary"):
     # 重置会话状态
-    st.session_state.log_list = []
+    st.session_state.log_list = collections.deque(maxlen=50)
     st.session_state.process_success = False
-    st.session_state.save_path = ""
+    st.session_state.result_bytes = None
     streamlit_log_callback("🔍 开始校验上传文件，准备处理...")
 
     # 第一步：校验文件是否上传
     if not template_file or not data_file:
         streamlit_log_callback("❌ 错误：请先上传模板文件和数据文件，缺一不可！")
     else:
-        # 第二步：将Streamlit上传的内存文件保存为临时文件（适配core_excel.py的文件路径入参）
+        # 第二步：调用带缓存的核心Excel处理函数（传入日志回调，相同文件直接复用缓存结果）
         try:
-            # 创建临时目录，自动清理
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 保存模板临时文件
-                template_temp_path = os.path.join(temp_dir, "template_temp.xlsx")
-                with open(template_temp_path, "wb") as f:
-                    f.write(template_file.getbuffer())
-                # 保存数据临时文件
-                data_temp_path = os.path.join(temp_dir, "data_temp.xlsx")
-                with open(data_temp_path, "wb") as f:
-                    f.write(data_file.getbuffer())
-                # 结果文件保存路径（项目根目录，方便用户查找）
-                result_path = os.path.join(os.getcwd(), result_filename)
-                st.session_state.save_path = result_path
-
-                # 第三步：调用封装好的核心Excel处理函数（传入日志回调）
-                streamlit_log_callback("⚙️ 开始调用核心处理逻辑，正在处理数据...")
-                with st.spinner("处理中，请稍候（请勿刷新页面，避免中断）..."):
-                    success, error_msg = process_excel_core(
-                        template_path=template_temp_path,
-                        data_path=data_temp_path,
-                        save_path=result_path,
-                        log_callback=streamlit_log_callback
-                    )
-
-                # 第四步：处理结果反馈
-                st.session_state.process_success = success
-                if success:
-                    streamlit_log_callback(f"🎉 处理成功！结果文件已保存至项目根目录：{result_path}")
-                else:
-                    streamlit_log_callback(f"❌ 处理失败：{error_msg}")
+            streamlit_log_callback("⚙️ 开始调用核心处理逻辑，正在处理数据...")
+            call_started_at = time.time()
+            with st.spinner("处理中，请稍候（请勿刷新页面，避免中断）..."):
+                success, error_msg, result_bytes, core_logs, processed_at = _cached_process(
+                    template_file.getvalue(),
+                    data_file.getvalue()
+                )
+            # 处理完成时间早于本次调用，说明直接复用了缓存结果
+            if processed_at < call_started_at:
+                append_log("♻️ 命中缓存，复用上次处理结果（以下为上次处理日志）")
+            # 回放核心处理日志（缓存命中时同样显示表名、舟山区行数、合并总数等信息）
+            for core_msg in core_logs:
+                append_log(core_msg)
+
+            # 第三步：处理结果反馈
+            st.session_state.process_success = success
+            st.session_state.result_bytes = result_bytes
+            if success:
+                streamlit_log_callback("🎉 处理成功！请在下方下载结果文件")
+            else:
+                streamlit_log_callback(f"❌ 处理失败：{error_msg}")
         except Exception as e:
-            streamlit_log_callback(f"❌ 临时文件处理失败：{str(e)}")
+            streamlit_log_callback(f"❌ 文件处理失败：{str(e)}")
+
+    # 处理结束后统一刷新一次日志区域，确保回放的核心日志全部显示
+    render_log_area()
 
 st.divider()
 
 # 6. 结果下载区域（处理成功后显示，移动端直接下载）
 st.subheader("📁 结果下载", divider="gray")
-if st.session_state.process_success and os.path.exists(st.session_state.save_path):
-    # 读取结果文件为字节流，支持移动端下载
-
-
-    # 加固：将Excel文件转换为base64编码，强制指定下载格式
-    with open(st.session_state.save_path, "rb") as f:
-        result_bytes = f.read()
-        b64 = base64.b64encode(result_bytes).decode()
-
-    # 构建下载链接（强制Excel格式，避免浏览器误判）
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{result_filename}" style="display:block;width:100%;padding:12px 0;text-align:center;background-color:#0e1117;color:white;border-radius:8px;text-decoration:none;font-size:16px;">点击下载处理结果Excel文件</a>'
-
-    # 显示自定义下载按钮（替代原st.download_button，兼容性更强）
-    st.markdown(href, unsafe_allow_html=True)
-    st.info(f"💡 结果文件同时保存在本地：{st.session_state.save_path}", icon="ℹ️")
+if st.session_state.process_success and st.session_state.result_bytes:
+    # 直接下发结果文件字节流（无需base64内联编码，强制指定Excel格式，避免浏览器误判）
+    st.download_button(
+        label="点击下载处理结果Excel文件",
+        data=st.session_state.result_bytes,
+        file_name=result_filename,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        use_container_width=True
+    )
 elif st.session_state.log_list and "处理失败" in st.session_state.log_list[-1]:
     st.error("❌ 处理失败，请查看上方日志排查问题！", icon="⚠️")
 else:
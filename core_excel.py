@@ -1,14 +1,57 @@
 # core_excel.py
+import io
 import os
+import stat
+import uuid
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
+from openpyxl.cell import Cell
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.xml import LXML
 from datetime import datetime
 
 # -------------------------- 基础配置（保留原有，抑制无关警告） --------------------------
+# 仅在模块顶层注册一次（filterwarnings自动去重）；不用catch_warnings，它会改写全局过滤列表，线程/并发会话下不安全
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="openpyxl")
 
+# openpyxl检测到lxml时才使用C实现的XML解析/写入，否则退回标准库xml.etree（模板加载和保存明显变慢）
+if not LXML:
+    raise ImportError("未检测到lxml（或设置了OPENPYXL_LXML=False），请先执行 pip install lxml 以加速Excel模板读写")
+
+# -------------------------- 数据文件列配置（原代码指定列索引，保持不变，确保功能一致） --------------------------
+# 发货表：列索引 -> 列名
+SHIP_COL_MAP = {
+    3: '城市群',
+    7: '客户名称',
+    15: '物品说明',
+    21: '发货数量',
+    24: '净重(吨)',
+    26: '价目表价格',
+    28: '签收关单时间',  # AC列：签收关单时间（带时分秒）
+    43: '税率'
+}
+# 滞留表：列索引 -> 列名
+DELAY_COL_MAP = {
+    3: '城市群',
+    5: '客户名称',
+    18: '物品说明',
+    26: '发运库存组织',  # 用于剔除空值
+    27: '发货数量',  # 订货数量对应发货数量
+    30: '净重(吨)',
+    33: '价目表价格',
+    55: '税率'
+}
+# 需转换为数值类型的列
+NUMERIC_COLS = ['发货数量', '净重(吨)', '价目表价格', '税率']
+# 数值列统一的目标类型（发货/滞留表一致，合并时不会因int64/float64/object混杂而退化为object）
+NUMERIC_DTYPES = {col: 'float64' for col in NUMERIC_COLS}
+# 填充到模板的列（顺序与模板清洗/填充列 D/H/O/U/X/Z/AQ/AS 一一对应）
+FILL_COLUMNS = ['城市群', '客户名称', '物品说明', '发货数量', '净重(吨)', '价目表价格', '税率', '签收关单时间']
+
 
 # -------------------------- 辅助函数：日期处理（提取年月日，剔除时分秒） --------------------------
 def process_date_column(df, date_col_name):
@@ -18,16 +61,13 @@ def process_date_column(df, date_col_name):
     :param date_col_name: 日期列名称
     :return: 处理后的DataFrame
     """
+    # 转为datetime64[D]在NumPy层面直接截断时分秒（C循环，不逐个生成Python date对象），NaT保持不变
     df[date_col_name] = pd.to_datetime(
         df[date_col_name],
         format=None,
         errors='coerce',
         dayfirst=False
-    )
-    # 提取仅日期部分（去掉时分秒），保留NaT不处理
-    valid_dates = df[date_col_name].notna()
-    df.loc[valid_dates, date_col_name] = df.loc[valid_dates, date_col_name].dt.date
-    df[date_col_name] = df[date_col_name].fillna(pd.NaT)
+    ).values.astype('datetime64[D]')
     return df
 
 
@@ -39,14 +79,89 @@ def convert_numeric_columns(df, numeric_col_names):
     :param numeric_col_names: 数值列名称列表
     :return: 处理后的DataFrame
     """
-    for col in numeric_col_names:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # 已是数值类型的列（calamine读取的纯数字列）无需转换，其余列一次性批量转换
+    numeric_subset = [
+        col for col in numeric_col_names
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col])
+    ]
+    if numeric_subset:
+        df[numeric_subset] = df[numeric_subset].apply(pd.to_numeric, errors='coerce')
     return df
 
 
+# -------------------------- 辅助函数：读取发货表舟山区数据 --------------------------
+def extract_ship_data(data_source, sheet_name):
+    """
+    辅助函数：读取发货表指定列，筛选舟山区数据，转换数值类型并仅保留签收关单时间的年月日
+    （不输出日志、不共享读取器，可放入线程池与滞留表读取/模板加载并行执行）
+    :param data_source: 数据文件路径或文件对象（并行时每个任务需使用独立的文件对象）
+    :param sheet_name: 发货表名称
+    :return: 舟山区发货数据DataFrame
+    """
+    # 仅读取需要的列（usecols），读取结果按列索引升序排列，直接按位置重命名
+    df_ship = pd.read_excel(
+        data_source, sheet_name=sheet_name, engine='calamine', usecols=list(SHIP_COL_MAP), header=0
+    )
+    df_ship.columns = [SHIP_COL_MAP[idx] for idx in sorted(SHIP_COL_MAP)]
+
+    # 先筛选舟山区数据（保持原代码硬编码，后续可优化为配置项），再只对筛选结果做类型转换
+    ship_mask = (df_ship['城市群'] == '舟山区').to_numpy()
+    df_ship_zhoushan = pd.DataFrame({name: df_ship[name].to_numpy()[ship_mask] for name in df_ship.columns})
+
+    # 转换数值型列为数字类型并统一为float64，签收关单时间仅保留年月日，剔除时分秒（复用辅助函数）
+    df_ship_zhoushan = convert_numeric_columns(df_ship_zhoushan, NUMERIC_COLS).astype(NUMERIC_DTYPES)
+    df_ship_zhoushan = process_date_column(df_ship_zhoushan, '签收关单时间')
+    return df_ship_zhoushan
+
+
+# -------------------------- 辅助函数：读取滞留表舟山区数据 --------------------------
+def extract_delay_data(data_source, sheet_name):
+    """
+    辅助函数：读取滞留表指定列，筛选舟山区且发运库存组织非空的数据，转换数值类型并置空签收关单时间
+    （不输出日志、不共享读取器，可放入线程池与发货表读取/模板加载并行执行）
+    :param data_source: 数据文件路径或文件对象（并行时每个任务需使用独立的文件对象）
+    :param sheet_name: 滞留表名称
+    :return: 舟山区滞留数据DataFrame
+    """
+    df_delay = pd.read_excel(
+        data_source, sheet_name=sheet_name, engine='calamine', usecols=list(DELAY_COL_MAP), header=0
+    )
+    df_delay.columns = [DELAY_COL_MAP[idx] for idx in sorted(DELAY_COL_MAP)]
+
+    # 筛选舟山区 + 剔除发运库存组织为空的行（在原始列上一次性计算掩码，发运库存组织不再带入结果）
+    delay_org = df_delay['发运库存组织']
+    delay_mask = (
+            (df_delay['城市群'] == '舟山区') &
+            delay_org.notna() &
+            (delay_org != '')
+    ).to_numpy()
+    df_delay_zhoushan = pd.DataFrame({
+        name: df_delay[name].to_numpy()[delay_mask] for name in df_delay.columns if name != '发运库存组织'
+    })
+
+    # 转换滞留表数值列类型并统一为float64
+    df_delay_zhoushan = convert_numeric_columns(df_delay_zhoushan, NUMERIC_COLS).astype(NUMERIC_DTYPES)
+
+    # 滞留表签收关单时间统一置空（用None，兼容openpyxl）
+    df_delay_zhoushan['签收关单时间'] = None
+    return df_delay_zhoushan
+
+
+# -------------------------- 辅助函数：加载模板文件（屏蔽openpyxl无关警告） --------------------------
+def load_template_workbook(template_file):
+    """
+    辅助函数：加载模板文件（保留所有原始格式/公式），文件不存在时给出明确提示
+    :param template_file: 模板文件路径或文件对象
+    :return: openpyxl工作簿对象
+    """
+    try:
+        return load_workbook(template_file, data_only=False, keep_links=False)
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"模板文件不存在：{template_file}") from e
+
+
 # -------------------------- 核心Excel处理函数（脱离GUI依赖，封装为独立模块） --------------------------
-def process_excel_core(template_path, data_path, save_path, log_callback=None):
+def process_excel_core(template_file, data_file, save_path, log_callback=None):
     """
     核心Excel处理逻辑（与原代码功能完全一致，脱离GUI依赖）
     1.  清洗模板表原有数据（仅清空值，保留格式/公式）
@@ -54,9 +169,9 @@ def process_excel_core(template_path, data_path, save_path, log_callback=None):
     3.  提取发货表AC列（签收关单时间），仅保留日期部分，填充到模板表AS列（45列），滞留表置空
     4.  严格以模板的格式为基准，仅填充数据（不改任何格式）
 
-    :param template_path: 模板文件路径
-    :param data_path: 数据文件路径
-    :param save_path: 结果文件保存路径
+    :param template_file: 模板文件路径或文件对象（如BytesIO，无需落盘）
+    :param data_file: 数据文件路径或文件对象（如BytesIO，无需落盘）
+    :param save_path: 结果文件保存路径或可写文件对象（如BytesIO）
     :param log_callback: 日志回调函数（可选，用于输出实时日志，默认print输出）
     :return: 处理结果（布尔值）、错误信息（str，成功为None）
     """
@@ -69,139 +184,140 @@ def process_excel_core(template_path, data_path, save_path, log_callback=None):
         log_callback = default_log_callback
 
     try:
-        # 1. 验证文件是否存在
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f"模板文件不存在：{template_path}")
-        if not os.path.exists(data_path):
-            raise FileNotFoundError(f"数据文件不存在：{data_path}")
-
         log_callback("开始读取数据文件（提取数据并转换数值类型）...")
 
-        # 2. 读取数据文件，模糊匹配发货/滞留表
-        xl = pd.ExcelFile(data_path)
-        ship_sheet_name = [name for name in xl.sheet_names if "发货" in name][0]
-        delay_sheet_name = [name for name in xl.sheet_names if "滞留" in name][0]
+        # 1. 读取数据文件：只读入内存一次；calamine工作簿对象不能跨线程共享，后续每个并行任务各用独立的BytesIO
+        # 不预先os.path.exists校验（读取时会再次stat），文件不存在时由读取本身抛错
+        if isinstance(data_file, (str, os.PathLike)):
+            try:
+                with open(data_file, 'rb') as f:
+                    data_bytes = f.read()
+            except FileNotFoundError as e:
+                raise FileNotFoundError(f"数据文件不存在：{data_file}") from e
+        else:
+            data_bytes = data_file.read()
+
+        # 2. 模糊匹配发货/滞留表
+        with pd.ExcelFile(io.BytesIO(data_bytes), engine='calamine') as xl:
+            sheet_names = xl.sheet_names
+        ship_sheet_name = [name for name in sheet_names if "发货" in name][0]
+        delay_sheet_name = [name for name in sheet_names if "滞留" in name][0]
 
         log_callback(f"识别到数据文件发货表：{ship_sheet_name}，滞留表：{delay_sheet_name}")
 
-        # 3. 处理发货表数据（提取指定列、转换数值类型、处理日期、筛选舟山区）
-        log_callback("提取数据文件发货表舟山区数据并转换数值类型...")
-        df_ship = pd.read_excel(data_path, sheet_name=ship_sheet_name)
-        # 原代码指定列索引（保持不变，确保功能一致）
-        ship_cols = {
-            '城市群': df_ship.iloc[:, 3],
-            '客户名称': df_ship.iloc[:, 7],
-            '物品说明': df_ship.iloc[:, 15],
-            '发货数量': df_ship.iloc[:, 21],
-            '净重(吨)': df_ship.iloc[:, 24],
-            '价目表价格': df_ship.iloc[:, 26],
-            '税率': df_ship.iloc[:, 43],
-            '签收关单时间': df_ship.iloc[:, 28]  # AC列：签收关单时间（带时分秒）
-        }
-        df_ship_processed = pd.DataFrame(ship_cols)
-
-        # 转换数值型列为数字类型（复用辅助函数）
-        numeric_cols = ['发货数量', '净重(吨)', '价目表价格', '税率']
-        df_ship_processed = convert_numeric_columns(df_ship_processed, numeric_cols)
-
-        # 处理日期列：仅保留年月日，剔除时分秒（复用辅助函数）
-        log_callback("转换发货表签收关单时间（仅保留年月日，隐藏时分秒）...")
-        df_ship_processed = process_date_column(df_ship_processed, '签收关单时间')
-
-        # 筛选舟山区数据（保持原代码硬编码，后续可优化为配置项）
-        df_ship_zhoushan = df_ship_processed[df_ship_processed['城市群'] == '舟山区'].copy()
-        log_callback(f"数据文件发货表提取到舟山区数据 {len(df_ship_zhoushan)} 行")
-
-        # 4. 处理滞留表数据（提取指定列、转换数值类型、置空日期、筛选舟山区有效数据）
-        log_callback("提取数据文件滞留表舟山区数据并转换数值类型...")
-        df_delay = pd.read_excel(data_path, sheet_name=delay_sheet_name)
-        # 原代码指定列索引（保持不变，确保功能一致）
-        delay_cols = {
-            '城市群': df_delay.iloc[:, 3],
-            '客户名称': df_delay.iloc[:, 5],
-            '物品说明': df_delay.iloc[:, 18],
-            '发货数量': df_delay.iloc[:, 27],  # 订货数量对应发货数量
-            '净重(吨)': df_delay.iloc[:, 30],
-            '价目表价格': df_delay.iloc[:, 33],
-            '税率': df_delay.iloc[:, 55],
-            '发运库存组织': df_delay.iloc[:, 26],  # 用于剔除空值
-            '签收关单时间': pd.Series(dtype='object')  # 初始化空列，兼容日期格式
-        }
-        df_delay_processed = pd.DataFrame(delay_cols)
-
-        # 转换滞留表数值列类型
-        df_delay_processed = convert_numeric_columns(df_delay_processed, numeric_cols)
-
-        # 滞留表签收关单时间统一置空（用None，兼容openpyxl）
-        df_delay_processed['签收关单时间'] = None
-
-        # 筛选舟山区 + 剔除发运库存组织为空的行
-        df_delay_zhoushan = df_delay_processed[
-            (df_delay_processed['城市群'] == '舟山区') &
-            (df_delay_processed['发运库存组织'].notna()) &
-            (df_delay_processed['发运库存组织'] != '')
-            ].copy()
-        df_delay_zhoushan = df_delay_zhoushan.drop('发运库存组织', axis=1)
+        # 3. 并行处理发货表、滞留表数据，同时加载模板文件（三者互不依赖；日志统一在主线程输出）
+        # 注意：模板不能改用write_only流式写入新工作簿——模板中其他工作表、公式列、列宽/合并单元格等
+        # 都需要原样保留，只能在模板DOM上填值；写入开销通过减少单元格创建和样式赋值来压缩
+        log_callback("提取数据文件发货/滞留表舟山区数据并转换数值类型，同时加载模板文件（保留所有原始格式）...")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            ship_future = executor.submit(extract_ship_data, io.BytesIO(data_bytes), ship_sheet_name)
+            delay_future = executor.submit(extract_delay_data, io.BytesIO(data_bytes), delay_sheet_name)
+            template_future = executor.submit(load_template_workbook, template_file)
+            df_ship_zhoushan = ship_future.result()
+            df_delay_zhoushan = delay_future.result()
+            wb = template_future.result()
+        log_callback(f"数据文件发货表提取到舟山区数据 {len(df_ship_zhoushan)} 行（签收关单时间仅保留年月日）")
         log_callback(f"数据文件滞留表提取到舟山区数据 {len(df_delay_zhoushan)} 行")
 
-        # 5. 合并发货/滞留数据，剔除全空行
+        # 4. 合并发货/滞留数据（逐列拼接底层数组，避免pd.concat的块合并开销）
+        # 两张表均已按城市群=舟山区筛选，不存在全空行，无需再dropna(how='all')
         log_callback("合并数据文件发货/滞留数据（仅保留日期，隐藏时分秒）...")
-        df_combined = pd.concat([df_ship_zhoushan, df_delay_zhoushan], ignore_index=True)
-        df_combined = df_combined.dropna(how='all')
+        df_combined = pd.DataFrame({
+            col: np.concatenate([df_ship_zhoushan[col].to_numpy(), df_delay_zhoushan[col].to_numpy()])
+            for col in FILL_COLUMNS
+        })
         log_callback(f"数据文件合并后总数据 {len(df_combined)} 行")
 
         if len(df_combined) == 0:
             log_callback("警告：数据文件合并后无有效数据！")
             return False, "数据文件合并后无有效数据"
 
-        # 6. 加载模板文件（保留所有原始格式/公式）
-        log_callback("加载模板文件（保留所有原始格式）...")
-        wb = load_workbook(template_path, data_only=False, keep_links=False)
+        # 5. 定位模板工作表
         if "宁波发货" not in wb.sheetnames:
             raise KeyError("模板文件中不存在'宁波发货'工作表")
         ws = wb["宁波发货"]
 
-        # 7. 数据清洗：清空模板表原有数据（仅清空值，保留格式/公式，AS列=45）
+        # 6. 数据清洗：清空模板表原有数据（仅清空值，保留格式/公式，AS列=45）
         log_callback("清洗模板表原有数据（仅清空数值，保留格式和公式）...")
         clean_columns = [4, 8, 15, 21, 24, 26, 43, 45]  # AS列=45（修正后）
         max_row = ws.max_row
-        # 从第2行开始清空（第1行是表头，保留不修改）
-        for row in range(2, max_row + 1):
+        # 第2行至new_last_row会被新数据整行覆盖，无需清空；只清空其后的模板旧数据行（第1行是表头，保留不修改）
+        new_last_row = 1 + len(df_combined)
+        existing_cells = ws._cells
+        for row in range(new_last_row + 1, max_row + 1):
             for col in clean_columns:
-                ws.cell(row=row, column=col).value = None  # 仅清空单元格值，保留格式
+                # 直接查单元格字典，模板中不存在的单元格无值可清，不再通过ws.cell()新建
+                existing_cell = existing_cells.get((row, col))
+                if existing_cell is not None:
+                    existing_cell.value = None  # 仅清空单元格值，保留格式
 
-        # 8. 填充新数据到模板（保留原格式，AS列=45设置日期格式）
+        # 7. 填充新数据到模板（保留原格式，AS列=45设置日期格式）
         log_callback("填充数据文件新数据到模板（仅保留日期，兼容Excel公式）...")
         start_row = 2  # 从第2行开始（避开表头）
-        for idx, (_, row) in enumerate(df_combined.iterrows()):
-            current_row = start_row + idx
-            # 文本列赋值（保持原列索引，确保格式匹配）
-            ws.cell(row=current_row, column=4).value = row['城市群']  # D列 城市群
-            ws.cell(row=current_row, column=8).value = row['客户名称']  # H列 客户名称
-            ws.cell(row=current_row, column=15).value = row['物品说明']  # O列 物品说明
-
-            # 数值列赋值+设置数字格式（保持原格式，确保Excel公式兼容）
-            ws.cell(row=current_row, column=21).value = row['发货数量']
-            ws.cell(row=current_row, column=21).number_format = '0.00'
-
-            ws.cell(row=current_row, column=24).value = row['净重(吨)']
-            ws.cell(row=current_row, column=24).number_format = '0.000'
-
-            ws.cell(row=current_row, column=26).value = row['价目表价格']
-            ws.cell(row=current_row, column=26).number_format = '0.00'
-
-            ws.cell(row=current_row, column=43).value = row['税率']
-            ws.cell(row=current_row, column=43).number_format = '0.00%'
-
-            # AS列=45 日期赋值+格式设置（仅保留年月日）
-            ws.cell(row=current_row, column=45).value = row['签收关单时间']
-            ws.cell(row=current_row, column=45).number_format = 'yyyy/mm/dd'
-
-        # 9. 保存结果文件（保留模板格式，兼容Excel公式）
-        wb.save(save_path)
-        wb.close()
-
-        log_callback(f"处理完成！模板表原有数据已清洗，AS列（45列）仅保留日期部分，保存至：{save_path}")
+        # 一次性取出8列为元组列表，避免iterrows逐行构造Series
+        records = list(df_combined[FILL_COLUMNS].itertuples(index=False, name=None))
+        # 数值/日期列的数字格式（列号 -> 格式），格式已一致的单元格不再重复赋值
+        number_formats = {
+            21: '0.00',  # U列 发货数量
+            24: '0.000',  # X列 净重(吨)
+            26: '0.00',  # Z列 价目表价格
+            43: '0.00%',  # AQ列 税率
+            45: 'yyyy/mm/dd'  # AS列 签收关单时间（仅保留年月日）
+        }
+        # 模板中不存在的单元格（超出模板原有行）沿用第2行对应列的样式（套用目标数字格式），样式只计算一次
+        row_styles = {}
+        for col in clean_columns:
+            style_cell = Cell(ws, row=start_row, column=col, style_array=ws.cell(row=start_row, column=col)._style)
+            if col in number_formats:
+                style_cell.number_format = number_formats[col]
+            row_styles[col] = style_cell._style
+        # 目标数字格式对应的numFmtId（列号 -> 编号）只解析一次，填充时直接比较/写入样式数组中的编号
+        number_format_ids = {col: row_styles[col].numFmtId for col in number_formats}
+
+        new_cells = {}
+        for current_row, values in enumerate(records, start=start_row):
+            # 8列按clean_columns顺序依次赋值（D/H/O文本列，U/X/Z/AQ数值列，AS列=45日期），保持原列索引
+            for col, value in zip(clean_columns, values):
+                target = existing_cells.get((current_row, col))
+                if target is None:
+                    # 新单元格直接带上预先计算的样式创建，最后批量写入单元格字典
+                    new_cells[(current_row, col)] = Cell(
+                        ws, row=current_row, column=col, value=value, style_array=row_styles[col]
+                    )
+                    continue
+                target.value = value
+                # 仅替换数字格式编号，模板单元格的字体/边框等其余样式保持不变；格式已一致时跳过
+                if col in number_format_ids:
+                    if target._style is None:
+                        target._style = StyleArray()
+                    if target._style.numFmtId != number_format_ids[col]:
+                        target._style.numFmtId = number_format_ids[col]
+        existing_cells.update(new_cells)
+        # 直接写入单元格字典绕过了Worksheet._add_cell，需同步当前行号，避免后续ws.append()覆盖新写入的行
+        ws._current_row = max(ws._current_row, start_row + len(records) - 1)
+
+        # 8. 保存结果文件（保留模板格式，兼容Excel公式）
+        if isinstance(save_path, (str, os.PathLike)):
+            # 先写入同目录下的临时文件再原子替换，避免中途失败或并发保存时留下写了一半的xlsx
+            # 临时文件按普通新建文件的权限创建（0o666受umask约束），不用mkstemp，否则0600权限会随os.replace带到结果文件
+            temp_path = f"{os.fspath(save_path)}.{uuid.uuid4().hex}.tmp"
+            os.close(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            try:
+                wb.save(temp_path)
+                # 覆盖已有结果文件时沿用其原有权限（与直接覆盖写入一致）
+                try:
+                    os.chmod(temp_path, stat.S_IMODE(os.stat(save_path).st_mode))
+                except FileNotFoundError:
+                    pass
+                os.replace(temp_path, save_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        else:
+            wb.save(save_path)
+
+        save_target = save_path if isinstance(save_path, (str, os.PathLike)) else "内存缓冲区"
+        log_callback(f"处理完成！模板表原有数据已清洗，AS列（45列）仅保留日期部分，保存至：{save_target}")
         return True, None
 
     except Exception as e: